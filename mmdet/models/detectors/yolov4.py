@@ -2,9 +2,13 @@
 
 from ..builder import DETECTORS
 from .single_stage import SingleStageDetector
-from mmcv.runner import Hook, Fp16OptimizerHook, HOOKS, OptimizerHook
-from mmcv.parallel import is_module_wrapper
+from mmcv.runner import (Hook, Fp16OptimizerHook, HOOKS, LoggerHook,
+                         OptimizerHook)
+from mmcv.parallel import MMDistributedDataParallel, is_module_wrapper
+import inspect
 import math
+import os
+import torch
 from torch.cuda.amp import GradScaler, autocast
 from ...datasets import PIPELINES
 from ...datasets.pipelines.compose import Compose
@@ -13,8 +17,55 @@ import numpy as np
 import os.path as osp
 import random
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from mmcv.runner.dist_utils import master_only
 
+_HAS_FOREACH = hasattr(torch, '_foreach_mul_')
+_HAS_SET_TO_NONE = 'set_to_none' in inspect.signature(
+    torch.optim.Optimizer.zero_grad).parameters
+
+
+_MOSAIC_POOL = None
+_MOSAIC_POOL_PID = None
+
+
+def _get_mosaic_pool(num_threads):
+    """Thread pool used to load mosaic tiles, created lazily per process so
+    that forked dataloader workers do not inherit a pool without threads."""
+    global _MOSAIC_POOL, _MOSAIC_POOL_PID
+    if _MOSAIC_POOL is None or _MOSAIC_POOL_PID != os.getpid():
+        _MOSAIC_POOL = ThreadPoolExecutor(max_workers=num_threads)
+        _MOSAIC_POOL_PID = os.getpid()
+    return _MOSAIC_POOL
+
+
+def _no_op(*args, **kwargs):
+    pass
+
+
+def _zero_grad(obj):
+    """Clear the grads of a module or optimizer, releasing them instead of
+    filling them with zeros when the installed torch supports it."""
+    if _HAS_SET_TO_NONE:
+        obj.zero_grad(set_to_none=True)
+    else:
+        obj.zero_grad()
+
+
+def _ema_update(params, buffers, momentum):
+    """In-place ``buffer = momentum * buffer + (1 - momentum) * param``.
+
+    Uses the multi-tensor ``_foreach`` kernels when available so that the
+    whole list is updated with a handful of launches instead of two per
+    tensor.
+    """
+    if _HAS_FOREACH:
+        torch._foreach_mul_(buffers, momentum)
+        torch._foreach_add_(buffers, params, alpha=1 - momentum)
+    else:
+        for buffer, param in zip(buffers, params):
+            buffer.mul_(momentum).add_(param, alpha=1 - momentum)
+
 
 @DETECTORS.register_module()
 class YOLOV4(SingleStageDetector):
@@ -56,32 +107,83 @@ class AMPGradAccumulateOptimizerHook(OptimizerHook):
     def before_run(self, runner):
         assert hasattr(runner.model.module,
                        'use_amp') and runner.model.module.use_amp, 'model should support AMP when using this optimizer hook!'
-        runner.model.zero_grad()
-        runner.optimizer.zero_grad()
+        # GradScaler.step reads the inf check result on the host unless the
+        # optimizer consumes it on device, only suggest ``fused=True`` when
+        # the installed optimizer class accepts it
+        optimizer_cls = type(runner.optimizer)
+        if not getattr(runner.optimizer, '_step_supports_amp_scaling',
+                       False) and 'fused' in inspect.signature(
+                           optimizer_cls.__init__).parameters:
+            runner.logger.info(
+                f'{optimizer_cls.__name__} is not using on-device AMP '
+                'scaling, each optimizer step will sync with the GPU. Set '
+                'fused=True in the optimizer config to avoid it.')
+        # resolve the runner attributes once instead of in every iteration
+        self._optimizer = runner.optimizer
+        self._params = list(runner.model.parameters())
+        # the optimizer holds the model parameters, zeroing it is enough
+        _zero_grad(self._optimizer)
+        # grad norm / scale stay on device and are only fetched to the host
+        # right before a logger hook reads the log buffer
+        self._logger_hooks = [
+            hook for hook in runner.hooks if isinstance(hook, LoggerHook)
+        ]
+        self._pending_logs = []
 
     def before_train_iter(self, runner):
         if runner.iter % self.accumulation == 0:
-            runner.model.zero_grad()
-            runner.optimizer.zero_grad()
+            _zero_grad(self._optimizer)
 
     def after_train_iter(self, runner):
         scaled_loss = self.scaler.scale(runner.outputs['loss'])
         scaled_loss.backward()
 
         if (runner.iter + 1) % self.accumulation == 0:
-            scale = self.scaler.get_scale()
+            if self.scaler.is_enabled():
+                # clone since the scaler updates its scale tensor in place
+                scale = self.scaler._get_scale_async().detach().clone()
+            else:
+                scale = torch.tensor(self.scaler.get_scale())
+            grad_norm = None
             if self.grad_clip is not None:
-                self.scaler.unscale_(runner.optimizer)
-                grad_norm = self.clip_grads(runner.model.parameters())
-                if grad_norm is not None:
-                    # Add grad norm to the logger
-                    runner.log_buffer.update({'grad_norm': float(grad_norm)},
-                                             runner.outputs['num_samples'])
-            runner.log_buffer.update({'grad_scale': float(scale)},
-                                     runner.outputs['num_samples'])
-            self.scaler.step(runner.optimizer)
+                self.scaler.unscale_(self._optimizer)
+                grad_norm = self.clip_grads(self._params)
+            self._pending_logs.append(
+                (grad_norm, scale, runner.outputs['num_samples']))
+            self.scaler.step(self._optimizer)
             self.scaler.update()
 
+        if self.end_of_epoch(runner) or any(
+                self.every_n_inner_iters(runner, hook.interval)
+                if hook.by_epoch else self.every_n_iters(runner, hook.interval)
+                for hook in self._logger_hooks):
+            self._flush_logs(runner)
+
+    def _flush_logs(self, runner):
+        """Move pending grad norm / scale values to the log buffer with a
+        single device to host transfer."""
+        if not self._pending_logs:
+            return
+        values = [scale for _, scale, _ in self._pending_logs]
+        values += [
+            grad_norm.detach() for grad_norm, _, _ in self._pending_logs
+            if grad_norm is not None
+        ]
+        # the scale is a 1-element tensor on older torch while the grad norm
+        # is 0-d, flatten both so that every entry becomes one float
+        values = torch.cat([value.float().reshape(1)
+                            for value in values]).tolist()
+        scales = values[:len(self._pending_logs)]
+        grad_norms = iter(values[len(self._pending_logs):])
+        for (grad_norm, _, num_samples), scale in zip(self._pending_logs,
+                                                      scales):
+            if grad_norm is not None:
+                # Add grad norm to the logger
+                runner.log_buffer.update({'grad_norm': next(grad_norms)},
+                                         num_samples)
+            runner.log_buffer.update({'grad_scale': scale}, num_samples)
+        self._pending_logs = []
+
 
 @HOOKS.register_module()
 class Fp16GradAccumulateOptimizerHook(Fp16OptimizerHook):
@@ -91,13 +193,17 @@ class Fp16GradAccumulateOptimizerHook(Fp16OptimizerHook):
 
     def before_run(self, runner):
         super(Fp16GradAccumulateOptimizerHook, self).before_run(runner)
-        runner.model.zero_grad()
-        runner.optimizer.zero_grad()
+        self._model = runner.model
+        self._optimizer = runner.optimizer
+        _zero_grad(self._model)
+        self._optimizer.zero_grad()
 
     def before_train_iter(self, runner):
         if runner.iter % self.accumulation == 0:
-            runner.model.zero_grad()
-            runner.optimizer.zero_grad()
+            # the fp32 master grads are overwritten by copy_grads_to_fp32, so
+            # keep them allocated and only release the fp16 model grads
+            _zero_grad(self._model)
+            self._optimizer.zero_grad()
 
     def after_train_iter(self, runner):
         """Backward optimization steps for Mixed Precision Training.
@@ -109,21 +215,18 @@ class Fp16GradAccumulateOptimizerHook(Fp16OptimizerHook):
         5. Copy back the params from fp32 weight copy to the fp16 model.
         """
         # clear grads of last iteration
+        # grads are cleared in before_train_iter at the start of each
+        # accumulation window, so the parent hook must not clear them
         if (runner.iter + 1) % self.accumulation == 0:
-            model_zero_grad = runner.model.zero_grad
-            optimizer_zero_grad = runner.optimizer.zero_grad
-
-            def dummyfun(*args):
-                pass
-
-            runner.model.zero_grad = dummyfun
-            runner.optimizer.zero_grad = dummyfun
-
-            super(Fp16GradAccumulateOptimizerHook,
-                  self).after_train_iter(runner)
-
-            runner.model.zero_grad = model_zero_grad
-            runner.optimizer.zero_grad = optimizer_zero_grad
+            model, optimizer = self._model, self._optimizer
+            model.zero_grad = optimizer.zero_grad = _no_op
+            try:
+                super(Fp16GradAccumulateOptimizerHook,
+                      self).after_train_iter(runner)
+            finally:
+                # drop the instance attributes to expose the methods again
+                del model.zero_grad
+                del optimizer.zero_grad
         else:
             scaled_loss = runner.outputs['loss'] * self.loss_scale
             scaled_loss.backward()
@@ -142,9 +245,16 @@ class YoloV4WarmUpHook(Hook):
         self.lr_bias_warmup = lr_bias_warmup
         self.momentum_warmup = momentum_warmup
 
-        self.bias_base_lr = {}  # initial lr for all param groups
-        self.weight_base_lr = {}
-        self.base_momentum = {}
+        # (group index, initial value) pairs
+        self.bias_base_lr = []
+        self.weight_base_lr = []
+        self.base_momentum = []
+        # the same pairs bound to the param group dicts, so that no index
+        # lookup is done in every iteration
+        self._param_groups = None
+        self._bias_groups = []
+        self._weight_groups = []
+        self._momentum_groups = []
 
     def before_run(self, runner):
         # NOTE: when resuming from a checkpoint, if 'initial_lr' is not saved,
@@ -156,27 +266,40 @@ class YoloV4WarmUpHook(Hook):
 
         for group_ind, (name, param) in enumerate(runner.model.named_parameters()):
             group = runner.optimizer.param_groups[group_ind]
-            self.base_momentum[group_ind] = group['momentum']
+            self.base_momentum.append((group_ind, group['momentum']))
             if name.endswith('.bias'):
-                self.bias_base_lr[group_ind] = group['lr']
+                self.bias_base_lr.append((group_ind, group['lr']))
             elif name.endswith('.weight'):
-                self.weight_base_lr[group_ind] = group['lr']
+                self.weight_base_lr.append((group_ind, group['lr']))
+        self._bind_param_groups(runner.optimizer.param_groups)
+
+    def _bind_param_groups(self, param_groups):
+        """Resolve the group indices to the param group dicts."""
+        self._param_groups = param_groups
+        self._bias_groups = [(param_groups[group_ind], base)
+                             for group_ind, base in self.bias_base_lr]
+        self._weight_groups = [(param_groups[group_ind], base)
+                               for group_ind, base in self.weight_base_lr]
+        self._momentum_groups = [(param_groups[group_ind], base)
+                                 for group_ind, base in self.base_momentum]
 
     def before_train_iter(self, runner):
-        if runner.iter <= self.warmup_iters:
-            prog = runner.iter / self.warmup_iters
-            for group_ind, bias_base in self.bias_base_lr.items():
-                bias_warmup_lr = prog * bias_base + \
-                                 (1 - prog) * self.lr_bias_warmup
-                runner.optimizer.param_groups[group_ind]['lr'] = bias_warmup_lr
-            for group_ind, weight_base in self.weight_base_lr.items():
-                weight_warmup_lr = prog * weight_base + \
-                                   (1 - prog) * self.lr_weight_warmup
-                runner.optimizer.param_groups[group_ind]['lr'] = weight_warmup_lr
-            for group_ind, momentum_base in self.base_momentum.items():
-                warmup_momentum = prog * momentum_base + \
-                                  (1 - prog) * self.momentum_warmup
-                runner.optimizer.param_groups[group_ind]['momentum'] = warmup_momentum
+        if runner.iter > self.warmup_iters:
+            return
+        # Optimizer.load_state_dict (e.g. a resume after before_run) replaces
+        # the param group dicts, rebind to the new ones
+        if runner.optimizer.param_groups is not self._param_groups:
+            self._bind_param_groups(runner.optimizer.param_groups)
+        prog = runner.iter / self.warmup_iters
+        bias_warmup = (1 - prog) * self.lr_bias_warmup
+        weight_warmup = (1 - prog) * self.lr_weight_warmup
+        momentum_warmup = (1 - prog) * self.momentum_warmup
+        for group, bias_base in self._bias_groups:
+            group['lr'] = prog * bias_base + bias_warmup
+        for group, weight_base in self._weight_groups:
+            group['lr'] = prog * weight_base + weight_warmup
+        for group, momentum_base in self._momentum_groups:
+            group['momentum'] = prog * momentum_base + momentum_warmup
 
 
 @HOOKS.register_module()
@@ -200,19 +323,40 @@ class YOLOV4EMAHook(Hook):
         warm_up (int): During first warm_up steps, we may use smaller momentum
             to update ema parameters more slowly. Defaults to 100.
         resume_from (str): The checkpoint path. Defaults to None.
+        cpu_offload (bool): Keep the ema backup in pinned host memory instead
+            of on the GPU. Parameters are copied to the host asynchronously
+            and averaged there one ema step later. Only supported with
+            ``MMDistributedDataParallel``, since ``MMDataParallel`` requires
+            all module buffers to be on the GPU. Defaults to False.
+        compile_update (bool): Compile the ema update with ``torch.compile``
+            once the momentum stops changing after warm up. Ignored on torch
+            versions without ``torch.compile``. Defaults to False.
     """
 
     def __init__(self,
                  momentum=0.9999,
                  interval=2,
                  warm_up=2000,
-                 resume_from=None):
+                 resume_from=None,
+                 cpu_offload=False,
+                 compile_update=False):
         assert isinstance(interval, int) and interval > 0
         self.warm_up = warm_up
         self.interval = interval
         assert momentum > 0 and momentum < 1
         self.momentum = momentum
+        # past this iteration the warm up term momentum * exp(-iter / warm_up)
+        # is below fp32 resolution, so the momentum is constant
+        self._warmup_end_iter = math.ceil(
+            warm_up * math.log(momentum / np.finfo(np.float32).eps))
         self.checkpoint = resume_from
+        self.cpu_offload = cpu_offload and torch.cuda.is_available()
+        # the compiled function is only called with a constant momentum so
+        # it is traced once instead of once per warm up value
+        self._compiled_update = None
+        if compile_update and hasattr(torch, 'compile'):
+            import torch._dynamo
+            self._compiled_update = torch.compile(_ema_update, fullgraph=True)
 
     @master_only
     def before_run(self, runner):
@@ -220,17 +364,57 @@ class YOLOV4EMAHook(Hook):
 
         Register ema parameter as ``named_buffer`` to model
         """
+        assert not self.cpu_offload or isinstance(
+            runner.model, MMDistributedDataParallel), \
+            'cpu_offload is only supported with MMDistributedDataParallel, ' \
+            'MMDataParallel requires all module buffers to be on the GPU'
         model = runner.model
         if is_module_wrapper(model):
             model = model.module
         self.param_ema_buffer = {}
-        self.model_parameters = model.state_dict()
+        # keep the actual parameter / buffer objects so that their storage
+        # can be exchanged with the ema backup in ``_swap_ema_parameters``
+        self.model_parameters = model.state_dict(keep_vars=True)
         for name, value in self.model_parameters.items():
             # "." is not allowed in module's buffer name
             buffer_name = f"ema_{name.replace('.', '_')}"
             self.param_ema_buffer[name] = buffer_name
-            model.register_buffer(buffer_name, value.data.clone())
+            if self.cpu_offload and value.dtype.is_floating_point:
+                ema_buffer = torch.empty(
+                    value.shape, dtype=value.dtype, pin_memory=True)
+                ema_buffer.copy_(value.data)
+            else:
+                ema_buffer = value.data.clone()
+            model.register_buffer(buffer_name, ema_buffer)
         self.model_buffers = dict(model.named_buffers(recurse=True))
+        # only floating point tensors are averaged, integer ones (e.g.
+        # ``num_batches_tracked``) simply follow the live value
+        self._ema_items = []
+        for name, value in self.model_parameters.items():
+            buffer_name = self.param_ema_buffer[name]
+            if value.dtype.is_floating_point:
+                self._ema_items.append(
+                    (name, value, self.model_buffers[buffer_name]))
+            else:
+                self.model_buffers[buffer_name] = value
+        # bucket the pairs by (device, dtype) so each ``_foreach`` call stays
+        # on its fast path
+        buckets = {}
+        for _, value, ema_buffer in self._ema_items:
+            params, buffers = buckets.setdefault((value.device, value.dtype),
+                                                 ([], []))
+            params.append(value)
+            buffers.append(ema_buffer)
+        self._ema_buckets = list(buckets.values())
+        if self.cpu_offload:
+            # pinned host snapshot of the parameters, filled by async D2H
+            # copies and consumed by the next ema step
+            self._staging_buckets = [[
+                torch.empty(p.shape, dtype=p.dtype, pin_memory=True)
+                for p in params
+            ] for params, _ in self._ema_buckets]
+            self._pending_momentum = None
+            self._copy_event = None
         if self.checkpoint is not None:
             runner.resume(self.checkpoint)
 
@@ -239,16 +423,56 @@ class YOLOV4EMAHook(Hook):
         """Update ema parameter every self.interval iterations."""
         if (runner.iter + 1) % self.interval != 0:
             return
-        for name, parameter in self.model_parameters.items():
+        if runner.iter > self._warmup_end_iter:
+            momentum = self.momentum
+        else:
             momentum = self.momentum * \
                        (1 - math.exp(-runner.iter / self.warm_up))
-            buffer_name = self.param_ema_buffer[name]
-            if parameter.dtype.is_floating_point:
-                buffer_parameter = self.model_buffers[buffer_name]
-                buffer_parameter.mul_(momentum).add_(
-                    parameter.data, alpha=1 - momentum)
+        with torch.no_grad():
+            if self.cpu_offload:
+                self._flush_offloaded_update()
+                for staging_list, (params, _) in zip(self._staging_buckets,
+                                                     self._ema_buckets):
+                    for staging, param in zip(staging_list, params):
+                        staging.copy_(param, non_blocking=True)
+                self._copy_event = torch.cuda.Event()
+                self._copy_event.record()
+                self._pending_momentum = momentum
+            elif self._compiled_update is not None and \
+                    runner.iter > self._warmup_end_iter:
+                self._compiled_ema_update(runner, momentum)
             else:
-                self.model_buffers[buffer_name] = parameter.data
+                for params, buffers in self._ema_buckets:
+                    _ema_update(params, buffers, momentum)
+
+    def _compiled_ema_update(self, runner, momentum):
+        """Run the compiled ema update, falling back to eager mode if
+        compilation fails."""
+        for i, (params, buffers) in enumerate(self._ema_buckets):
+            try:
+                self._compiled_update(params, buffers, momentum)
+            except torch._dynamo.exc.TorchDynamoException as e:
+                # compilation fails before anything is written, so the
+                # remaining buckets including this one are updated eagerly.
+                # Runtime errors of the compiled code are not caught since
+                # the bucket may already be partially updated.
+                runner.logger.warning(
+                    'Failed to compile the ema update, fall back to eager '
+                    f'mode: {e}')
+                self._compiled_update = None
+                for params, buffers in self._ema_buckets[i:]:
+                    _ema_update(params, buffers, momentum)
+                return
+
+    def _flush_offloaded_update(self):
+        """Average the last host snapshot into the offloaded ema backup."""
+        if self._pending_momentum is None:
+            return
+        self._copy_event.synchronize()
+        for staging_list, (_, buffers) in zip(self._staging_buckets,
+                                              self._ema_buckets):
+            _ema_update(staging_list, buffers, self._pending_momentum)
+        self._pending_momentum = None
 
     @master_only
     def after_train_epoch(self, runner):
@@ -264,85 +488,131 @@ class YOLOV4EMAHook(Hook):
 
     @master_only
     def _swap_ema_parameters(self):
-        """Swap the parameter of model with parameter in ema_buffer."""
-        for name, value in self.model_parameters.items():
-            temp = value.data.clone()
-            ema_buffer = self.model_buffers[self.param_ema_buffer[name]]
-            value.data.copy_(ema_buffer.data)
-            ema_buffer.data.copy_(temp)
+        """Swap the parameter of model with parameter in ema_buffer.
+
+        The storages are exchanged by rebinding ``.data``, which needs no
+        copy. Offloaded ema backups live on another device and are copied.
+        """
+        if self.cpu_offload:
+            with torch.no_grad():
+                self._flush_offloaded_update()
+        for _, value, ema_buffer in self._ema_items:
+            if ema_buffer.device == value.device:
+                value.data, ema_buffer.data = ema_buffer.data, value.data
+            else:
+                temp = value.data.clone()
+                value.data.copy_(ema_buffer.data)
+                ema_buffer.data.copy_(temp)
 
 
 @PIPELINES.register_module()
 class MosaicPipeline(object):
+    """Combine 4 images into one mosaic image.
+
+    Args:
+        individual_pipeline (list[dict]): Pipeline applied to each of the 4
+            images before they are combined.
+        pad_val (int): Value of the canvas area not covered by any image.
+            Default: 0.
+        num_threads (int): Number of threads running the individual pipeline
+            of the 3 extra images while the current thread processes the
+            first one. Image decoding releases the GIL, so the loads overlap.
+            Random transforms in ``individual_pipeline`` then draw from the
+            global random generators in a thread scheduling dependent order,
+            so results are not reproducible even with a fixed seed.
+            Default: 0, load sequentially.
+    """
+
     def __init__(self,
                  individual_pipeline,
-                 pad_val=0):
+                 pad_val=0,
+                 num_threads=0):
         self.individual_pipeline = Compose(individual_pipeline)
         self.pad_val = pad_val
+        self.num_threads = num_threads
 
     def __call__(self, results):
         input_results = results.copy()
         mosaic_results = [results]
         dataset = results['dataset']
+        data_infos = dataset.data_infos
+        proposals = dataset.proposals
         # load another 3 images
+        num_samples = len(dataset)
         for _ in range(3):
-            idx = random.randint(0, len(dataset) - 1)
-            img_info = dataset.data_infos[idx]
+            idx = random.randrange(num_samples)
+            img_info = data_infos[idx]
             ann_info = dataset.get_ann_info(idx)
             _results = dict(img_info=img_info, ann_info=ann_info)
-            if dataset.proposals is not None:
-                _results['proposals'] = dataset.proposals[idx]
+            if proposals is not None:
+                _results['proposals'] = proposals[idx]
             dataset.pre_pipeline(_results)
             mosaic_results.append(_results)
 
-        for idx in range(4):
-            mosaic_results[idx] = self.individual_pipeline(mosaic_results[idx])
+        if self.num_threads > 0:
+            pool = _get_mosaic_pool(self.num_threads)
+            futures = [
+                pool.submit(self.individual_pipeline, _results)
+                for _results in mosaic_results[1:]
+            ]
+            mosaic_results[0] = self.individual_pipeline(mosaic_results[0])
+            for idx, future in enumerate(futures, 1):
+                mosaic_results[idx] = future.result()
+        else:
+            for idx in range(4):
+                mosaic_results[idx] = self.individual_pipeline(
+                    mosaic_results[idx])
 
+        img_fields = mosaic_results[0].get('img_fields', [])
+        bbox_fields = mosaic_results[0].get('bbox_fields', [])
         shapes = [results['pad_shape'] for results in mosaic_results]
         cxy = max(shapes[0][0], shapes[1][0], shapes[0][1], shapes[2][1])
         canvas_shape = (cxy * 2, cxy * 2, shapes[0][2])
 
-        # base image with 4 tiles
+        # base image with 4 tiles, each aligned to the center corner of its
+        # quadrant: top left, top right, bottom left, bottom right
+        quadrants = ((0, 0), (cxy, 0), (0, cxy), (cxy, cxy))
         canvas = dict()
-        for key in mosaic_results[0].get('img_fields', []):
-            canvas[key] = np.full(canvas_shape, self.pad_val, dtype=np.uint8)
+        for key in img_fields:
+            # only the quadrant areas not covered by a tile are filled below
+            canvas[key] = np.empty(canvas_shape, dtype=np.uint8)
         for i, results in enumerate(mosaic_results):
             h, w = results['pad_shape'][:2]
             # place img in img4
-            if i == 0:  # top left
-                x1, y1, x2, y2 = cxy - w, cxy - h, cxy, cxy
-            elif i == 1:  # top right
-                x1, y1, x2, y2 = cxy, cxy - h, cxy + w, cxy
-            elif i == 2:  # bottom left
-                x1, y1, x2, y2 = cxy - w, cxy, cxy, cxy + h
-            elif i == 3:  # bottom right
-                x1, y1, x2, y2 = cxy, cxy, cxy + w, cxy + h
-
-            for key in mosaic_results[0].get('img_fields', []):
-                canvas[key][y1:y2, x1:x2] = results[key]
-
+            x1, y1, x2, y2 = ((cxy - w, cxy - h, cxy, cxy),
+                              (cxy, cxy - h, cxy + w, cxy),
+                              (cxy - w, cxy, cxy, cxy + h),
+                              (cxy, cxy, cxy + w, cxy + h))[i]
+            qx1, qy1 = quadrants[i]
+            qx2, qy2 = qx1 + cxy, qy1 + cxy
+
+            for key in img_fields:
+                img = canvas[key]
+                img[qy1:y1, qx1:qx2] = self.pad_val
+                img[y2:qy2, qx1:qx2] = self.pad_val
+                img[y1:y2, qx1:x1] = self.pad_val
+                img[y1:y2, x2:qx2] = self.pad_val
+                # the tile is not used after being blitted, release it so
+                # the allocator can reuse its memory for the next tile
+                np.copyto(img[y1:y2, x1:x2], results.pop(key),
+                          casting='unsafe')
+
+            offset = np.array([x1, y1, x1, y1], dtype=np.float32)
             for key in results.get('bbox_fields', []):
-                bboxes = results[key]
-                bboxes[:, 0::2] = bboxes[:, 0::2] + x1
-                bboxes[:, 1::2] = bboxes[:, 1::2] + y1
-                results[key] = bboxes
+                results[key] = results[key] + offset
 
         output_results = input_results
         output_results['filename'] = None
         output_results['ori_filename'] = None
-        output_results['img_fields'] = mosaic_results[0].get('img_fields', [])
-        output_results['bbox_fields'] = mosaic_results[0].get(
-            'bbox_fields', [])
-        for key in output_results['img_fields']:
+        output_results['img_fields'] = img_fields
+        output_results['bbox_fields'] = bbox_fields
+        for key in img_fields:
             output_results[key] = canvas[key]
 
-        for key in output_results['bbox_fields']:
+        for key in bbox_fields + ['gt_labels']:
             output_results[key] = np.concatenate(
                 [r[key] for r in mosaic_results], axis=0)
 
-        output_results['gt_labels'] = np.concatenate(
-            [r['gt_labels'] for r in mosaic_results], axis=0)
-
         output_results['img_shape'] = canvas_shape
         output_results['ori_shape'] = canvas_shape
         output_results['flip'] = False
@@ -353,7 +623,8 @@ class MosaicPipeline(object):
     def __repr__(self):
         repr_str = (f'{self.__class__.__name__}('
                     f'individual_pipeline={self.individual_pipeline}, '
-                    f'pad_val={self.pad_val})')
+                    f'pad_val={self.pad_val}, '
+                    f'num_threads={self.num_threads})')
         return repr_str
 
 
@@ -417,3 +688,86 @@ class GtBBoxesFilter(object):
                     f'min_size={self.min_size}, '
                     f'max_aspect_ratio={self.max_aspect_ratio})')
         return repr_str
+
+
+@PIPELINES.register_module()
+class RoundPad(object):
+    """Pad the image evenly on all sides, keeping it centered.
+
+    Same as :class:`Pad` but the padding is split between the two sides of
+    each axis, and the bboxes, masks and segmentation maps are shifted
+    accordingly. Masks and segmentation maps are padded with 0.
+    Added keys are "pad_shape", "pad_fixed_size", "pad_size_divisor",
+
+    Args:
+        size (tuple, optional): Fixed padding size.
+        size_divisor (int, optional): The divisor of padded size.
+        pad_val (float, optional): Padding value, 0 by default.
+    """
+
+    def __init__(self, size=None, size_divisor=None, pad_val=0):
+        self.size = size
+        self.size_divisor = size_divisor
+        self.pad_val = pad_val
+        # only one of size and size_divisor should be valid
+        assert size is not None or size_divisor is not None
+        assert size is None or size_divisor is None
+
+    def __call__(self, results):
+        img_fields = results.get('img_fields', ['img'])
+        bbox_fields = results.get('bbox_fields', [])
+        size = self.size
+        divisor = self.size_divisor
+
+        ori_h, ori_w = results[img_fields[0]].shape[:2]
+        if size is not None:
+            pad_h, pad_w = size
+        else:
+            pad_h = (ori_h + divisor - 1) // divisor * divisor
+            pad_w = (ori_w + divisor - 1) // divisor * divisor
+        pad_top = (pad_h - ori_h) // 2
+        pad_left = (pad_w - ori_w) // 2
+
+        for key in img_fields:
+            results[key] = self._pad_img(results[key], pad_h, pad_w, pad_top,
+                                         pad_left, self.pad_val)
+        results['pad_shape'] = results[img_fields[0]].shape
+        results['pad_fixed_size'] = size
+        results['pad_size_divisor'] = divisor
+
+        if bbox_fields:
+            bbox_offset = np.array([pad_left, pad_top, pad_left, pad_top],
+                                   dtype=np.float32)
+            for key in bbox_fields:
+                results[key] = results[key] + bbox_offset
+        for key in results.get('mask_fields', []):
+            results[key] = results[key].expand(pad_h, pad_w, pad_top,
+                                               pad_left)
+        for key in results.get('seg_fields', []):
+            results[key] = self._pad_img(results[key], pad_h, pad_w, pad_top,
+                                         pad_left, 0)
+        return results
+
+    @staticmethod
+    def _pad_img(img, pad_h, pad_w, pad_top, pad_left, pad_val):
+        """Pad ``img`` writing ``pad_val`` only to the border strips."""
+        ori_h, ori_w = img.shape[:2]
+        bottom, right = pad_top + ori_h, pad_left + ori_w
+        shape = (pad_h, pad_w) + img.shape[2:]
+        if pad_val == 0:
+            padded = np.zeros(shape, dtype=img.dtype)
+        else:
+            padded = np.empty(shape, dtype=img.dtype)
+            padded[:pad_top] = pad_val
+            padded[bottom:] = pad_val
+            padded[pad_top:bottom, :pad_left] = pad_val
+            padded[pad_top:bottom, right:] = pad_val
+        padded[pad_top:bottom, pad_left:right] = img
+        return padded
+
+    def __repr__(self):
+        repr_str = (f'{self.__class__.__name__}('
+                    f'size={self.size}, '
+                    f'size_divisor={self.size_divisor}, '
+                    f'pad_val={self.pad_val})')
+        return repr_str
@@ -8,7 +8,10 @@ import torch
 from mmcv.utils import build_from_cfg
 
 from mmdet.core.evaluation.bbox_overlaps import bbox_overlaps
+from mmdet.core.mask import BitmapMasks
 from mmdet.datasets.builder import PIPELINES
+# the YOLOv4 transforms are registered along with the detector
+from mmdet.models.detectors import yolov4
 
 
 def test_resize():
@@ -318,6 +321,132 @@ def test_pad():
     assert img_shape[1] % 32 == 0
 
 
+def test_round_pad():
+    # test assertion if both size_divisor and size is None
+    with pytest.raises(AssertionError):
+        transform = dict(type='RoundPad')
+        build_from_cfg(transform, PIPELINES)
+
+    img = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+    bboxes = np.array([[10, 20, 30, 40], [0, 0, 150, 100]], dtype=np.float32)
+    masks = np.random.randint(0, 2, (2, 100, 150), dtype=np.uint8)
+    seg = np.ones((100, 150), dtype=np.uint8)
+
+    def _make_results():
+        return dict(
+            img=img.copy(),
+            img_fields=['img'],
+            gt_bboxes=bboxes.copy(),
+            bbox_fields=['gt_bboxes'],
+            gt_masks=BitmapMasks(masks.copy(), 100, 150),
+            mask_fields=['gt_masks'],
+            gt_semantic_seg=seg.copy(),
+            seg_fields=['gt_semantic_seg'])
+
+    # pad to a multiple of size_divisor, keeping the image centered
+    transform = dict(type='RoundPad', size_divisor=32)
+    transform = build_from_cfg(transform, PIPELINES)
+    results = transform(_make_results())
+    top, left = (128 - 100) // 2, (160 - 150) // 2
+    assert results['img'].shape == (128, 160, 3)
+    assert results['pad_shape'] == (128, 160, 3)
+    assert np.equal(results['img'][top:top + 100, left:left + 150], img).all()
+    inner = np.zeros((128, 160), dtype=bool)
+    inner[top:top + 100, left:left + 150] = True
+    assert (results['img'][~inner] == 0).all()
+    assert np.allclose(results['gt_bboxes'],
+                       bboxes + np.array([left, top, left, top]))
+    padded_masks = results['gt_masks'].to_ndarray()
+    assert padded_masks.shape == (2, 128, 160)
+    assert np.equal(padded_masks[:, top:top + 100, left:left + 150],
+                    masks).all()
+    assert (padded_masks[:, ~inner] == 0).all()
+    assert results['gt_semantic_seg'].shape == (128, 160)
+    assert (results['gt_semantic_seg'][inner] == 1).all()
+    assert (results['gt_semantic_seg'][~inner] == 0).all()
+
+    # pad to a fixed size with a non-zero pad_val
+    transform = dict(type='RoundPad', size=(120, 160), pad_val=114)
+    transform = build_from_cfg(transform, PIPELINES)
+    results = transform(_make_results())
+    top, left = (120 - 100) // 2, (160 - 150) // 2
+    assert results['img'].shape == (120, 160, 3)
+    assert results['pad_fixed_size'] == (120, 160)
+    assert np.equal(results['img'][top:top + 100, left:left + 150], img).all()
+    inner = np.zeros((120, 160), dtype=bool)
+    inner[top:top + 100, left:left + 150] = True
+    assert (results['img'][~inner] == 114).all()
+    assert np.allclose(results['gt_bboxes'],
+                       bboxes + np.array([left, top, left, top]))
+    # masks and segmentation maps are always padded with 0
+    assert (results['gt_masks'].to_ndarray()[:, ~inner] == 0).all()
+    assert (results['gt_semantic_seg'][~inner] == 0).all()
+
+
+def test_mosaic_pipeline(monkeypatch):
+    # (h, w) of the 4 tiles, each no larger than its quadrant
+    tile_shapes = [(40, 50), (30, 45), (50, 20), (35, 45)]
+
+    class _Dataset(object):
+        proposals = None
+        data_infos = [dict(tile=i) for i in range(4)]
+
+        def __len__(self):
+            return len(self.data_infos)
+
+        def get_ann_info(self, idx):
+            return dict()
+
+        def pre_pipeline(self, results):
+            pass
+
+    def _load_tile(results):
+        # fill each tile with a distinct value to locate it on the canvas
+        tile = results['img_info']['tile']
+        h, w = tile_shapes[tile]
+        img = np.full((h, w, 3), tile + 1, dtype=np.uint8)
+        results['img'] = img
+        results['img_fields'] = ['img']
+        results['pad_shape'] = img.shape
+        results['gt_bboxes'] = np.array([[0, 0, 5, 5]], dtype=np.float32)
+        results['bbox_fields'] = ['gt_bboxes']
+        results['gt_labels'] = np.array([tile], dtype=np.int64)
+        return results
+
+    # pick tiles 1, 2, 3 as the 3 extra images
+    partners = iter([1, 2, 3])
+    monkeypatch.setattr(yolov4.random, 'randrange',
+                        lambda stop: next(partners))
+
+    transform = dict(
+        type='MosaicPipeline', individual_pipeline=[_load_tile], pad_val=114)
+    transform = build_from_cfg(transform, PIPELINES)
+    dataset = _Dataset()
+    results = transform(
+        dict(dataset=dataset, img_info=dataset.data_infos[0]))
+
+    # cxy = max(h0, h1, w0, w2)
+    cxy = 50
+    assert results['img'].shape == (2 * cxy, 2 * cxy, 3)
+    assert results['img_shape'] == (2 * cxy, 2 * cxy, 3)
+    (h0, w0), (h1, w1), (h2, w2), (h3, w3) = tile_shapes
+    # (x1, y1) of each tile, aligned to the center corner of its quadrant
+    corners = [(cxy - w0, cxy - h0), (cxy, cxy - h1), (cxy - w2, cxy),
+               (cxy, cxy)]
+    covered = np.zeros((2 * cxy, 2 * cxy), dtype=bool)
+    for i, ((h, w), (x1, y1)) in enumerate(zip(tile_shapes, corners)):
+        assert (results['img'][y1:y1 + h, x1:x1 + w] == i + 1).all()
+        covered[y1:y1 + h, x1:x1 + w] = True
+    # every pixel outside the tiles is padded
+    assert (results['img'][~covered] == 114).all()
+
+    expected_bboxes = np.array([[x1, y1, x1 + 5, y1 + 5]
+                                for x1, y1 in corners],
+                               dtype=np.float32)
+    assert np.allclose(results['gt_bboxes'], expected_bboxes)
+    assert np.equal(results['gt_labels'], [0, 1, 2, 3]).all()
+
+
 def test_normalize():
     img_norm_cfg = dict(
         mean=[123.675, 116.28, 103.53],
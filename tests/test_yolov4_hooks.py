@@ -0,0 +1,150 @@
+import copy
+import logging
+import math
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn as nn
+from mmcv.runner import LogBuffer, TextLoggerHook
+
+from mmdet.models.detectors.yolov4 import (AMPGradAccumulateOptimizerHook,
+                                           YOLOV4EMAHook)
+
+
+class _StubScaler(object):
+    """GradScaler stand-in usable without CUDA, with a scale tensor of shape
+    (1, ) as returned by ``GradScaler._get_scale_async`` on torch 1.6."""
+
+    def __init__(self):
+        self._scale = torch.tensor([1024.])
+
+    def is_enabled(self):
+        return True
+
+    def _get_scale_async(self):
+        return self._scale
+
+    def scale(self, loss):
+        return loss
+
+    def unscale_(self, optimizer):
+        pass
+
+    def step(self, optimizer):
+        optimizer.step()
+
+    def update(self):
+        # GradScaler updates the scale tensor in place
+        self._scale.mul_(0.5)
+
+
+def _grad_norm(model, inputs):
+    model = copy.deepcopy(model)
+    model(inputs).pow(2).sum().backward()
+    return torch.norm(
+        torch.stack([p.grad.detach().norm() for p in model.parameters()]))
+
+
+def test_amp_grad_accumulate_hook_logs():
+    model = nn.Linear(3, 2)
+    model.use_amp = True
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    hook = AMPGradAccumulateOptimizerHook(
+        grad_clip=dict(max_norm=1e6, norm_type=2), accumulation=1)
+    hook.scaler = _StubScaler()
+    runner = SimpleNamespace(
+        model=SimpleNamespace(module=model, parameters=model.parameters),
+        optimizer=optimizer,
+        logger=logging.getLogger(__name__),
+        hooks=[TextLoggerHook(interval=2)],
+        log_buffer=LogBuffer(),
+        data_loader=range(10))
+    runner.hooks.append(hook)
+    hook.before_run(runner)
+
+    expected_grad_norms = []
+    inputs = torch.rand(4, 3)
+    for i in range(2):
+        runner.iter = runner.inner_iter = i
+        hook.before_train_iter(runner)
+        expected_grad_norms.append(float(_grad_norm(model, inputs)))
+        loss = model(inputs).pow(2).sum()
+        runner.outputs = dict(loss=loss, num_samples=4)
+        hook.after_train_iter(runner)
+        # values are only moved to the log buffer at the logging interval
+        if i == 0:
+            assert 'grad_scale' not in runner.log_buffer.val_history
+
+    # each entry is a plain float: 0-d grad norm and (1, ) scale alike
+    assert runner.log_buffer.val_history['grad_scale'] == [1024., 512.]
+    assert runner.log_buffer.n_history['grad_scale'] == [4, 4]
+    grad_norms = runner.log_buffer.val_history['grad_norm']
+    assert all(isinstance(v, float) for v in grad_norms)
+    assert grad_norms == pytest.approx(expected_grad_norms, rel=1e-5)
+    runner.log_buffer.average(2)
+    assert runner.log_buffer.output['grad_scale'] == pytest.approx(768.)
+    assert runner.log_buffer.output['grad_norm'] == pytest.approx(
+        sum(expected_grad_norms) / 2, rel=1e-5)
+
+
+def test_yolov4_ema_hook_swap():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Conv2d(3, 4, 1), nn.BatchNorm2d(4))
+    hook = YOLOV4EMAHook(momentum=0.5, interval=1, warm_up=1)
+    runner = SimpleNamespace(model=model)
+    hook.before_run(runner)
+
+    float_keys = [
+        k for k, v in model.state_dict().items()
+        if not k.startswith('ema_') and v.dtype.is_floating_point
+    ]
+    expected_ema = {k: model.state_dict()[k].clone() for k in float_keys}
+    for i in range(3):
+        runner.iter = i
+        # updates the BN running stats and num_batches_tracked
+        model(torch.rand(2, 3, 4, 4))
+        with torch.no_grad():
+            for param in model.parameters():
+                param.add_(1.)
+        hook.after_train_iter(runner)
+        momentum = 0.5 * (1 - math.exp(-i / 1))
+        state = model.state_dict()
+        for k in float_keys:
+            expected_ema[k] = momentum * expected_ema[k] + \
+                (1 - momentum) * state[k]
+
+    def ema_name(k):
+        return f"ema_{k.replace('.', '_')}"
+
+    state = model.state_dict()
+    live = {k: state[k].clone() for k in float_keys}
+    buffers = dict(model.named_buffers())
+    for k in float_keys:
+        assert torch.allclose(state[ema_name(k)], expected_ema[k])
+        # the update runs without autograd
+        assert not buffers[ema_name(k)].requires_grad
+        assert buffers[ema_name(k)].grad_fn is None
+    assert model[1].num_batches_tracked == 3
+
+    # the module's parameters / buffers take the ema values
+    hook.after_train_epoch(runner)
+    state = model.state_dict()
+    for k in float_keys:
+        assert torch.allclose(state[k], expected_ema[k])
+        assert torch.allclose(state[ema_name(k)], live[k])
+    assert torch.allclose(model[0].weight, expected_ema['0.weight'])
+    assert torch.allclose(model[1].running_mean,
+                          expected_ema['1.running_mean'])
+    assert isinstance(model[0].weight, nn.Parameter)
+    assert model[0].weight.requires_grad
+    assert model[1].num_batches_tracked == 3
+
+    # and get the training values back after the second swap
+    hook.before_train_epoch(runner)
+    state = model.state_dict()
+    for k in float_keys:
+        assert torch.allclose(state[k], live[k])
+        assert torch.allclose(state[ema_name(k)], expected_ema[k])
+    assert torch.allclose(model[0].weight, live['0.weight'])
+    assert model[1].num_batches_tracked == 3